@@ -27,7 +27,7 @@ setup(
         packages=['treetime'],
         install_requires = [
             'biopython>=1.66',
-            'numpy>=1.10.4',
+            'numpy>=1.15',
             'pandas>=0.17.1',
             'scipy>=0.16.1'
         ],
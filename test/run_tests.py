@@ -10,4 +10,14 @@ test_seq_joint_reconstruction_correct()
 
 test_seq_joint_lh_is_max()
 
+test_resolve_polytomies()
+
+test_confidence_intervals()
+
+test_base_chisq()
+
+test_branch_len_interpolator_copy()
+
+test_relaxed_clock_kernel()
+
 print('\n\n TEST HAVE FINISHED SUCCESSFULLY\n\n')
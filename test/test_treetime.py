@@ -230,3 +230,176 @@ def test_seq_joint_lh_is_max():
 
 
 
+
+
+def dated_polytomy_example():
+    """
+    newick string, alignment and dates of a small tree with a four-fold
+    polytomy P. Two of its children, C and D, are sampled late but carry few
+    mutations, hence merging them lowers the cost of their stretched branches.
+    """
+    import numpy as np
+    # mutated positions on each branch
+    mutations = {'P':[1,2,3], 'A':list(range(10,16)), 'B':list(range(20,26)), 'C':[30], 'D':[40],
+                 'Q':[50,51], 'E':[60,61,62], 'F':[70,71,72,73], 'G':[80,81,82,83,84]}
+    paths = {'A':'PA', 'B':'PB', 'C':'PC', 'D':'PD', 'E':'QE', 'F':'QF', 'G':'G'}
+    root_seq = np.array(list('ACGT'*250))
+    alnstr = ""
+    for tip, path in paths.items():
+        seq = root_seq.copy()
+        for branch in path:
+            for pos in mutations[branch]:
+                seq[pos] = 'A' if seq[pos]!='A' else 'G'
+        alnstr += ">" + tip + "\n" + ''.join(seq) + "\n"
+    dates = {'A':2015, 'B':2016, 'C':2014, 'D':2015, 'E':2008, 'F':2010, 'G':2009}
+    nwk = "((A:0.006,B:0.006,C:0.0011,D:0.0011)P:0.003,(E:0.003,F:0.004)Q:0.002,G:0.005);"
+    return nwk, alnstr, dates
+
+
+def test_resolve_polytomies():
+    """
+    Resolve the polytomy of the dated example and compare to a run without
+    polytomy resolution.
+    """
+    from treetime import TreeTime
+    from Bio import Phylo, AlignIO
+    import numpy as np
+
+    nwk, alnstr, dates = dated_polytomy_example()
+    LH = {}
+    for resolve in [False, True]:
+        np.random.seed(1)
+        tt = TreeTime(tree=Phylo.read(StringIO(nwk), 'newick'), aln=AlignIO.read(StringIO(alnstr), 'fasta'),
+                      dates=dates, gtr='JC69', verbose=0)
+        tt.run(root='least-squares', max_iter=1, resolve_polytomies=resolve, branch_length_mode='joint')
+        polytomy = [n for n in tt.tree.get_nonterminals() if n.name=='P'][0]
+        LH[resolve] = tt.tree.positional_joint_LH
+
+    # C and D are joined, A and B remain children of P
+    assert sorted(sorted(c.name for c in n.get_terminals()) for n in polytomy.clades) == [['A'], ['B'], ['C', 'D']]
+    assert LH[True] >= LH[False]
+
+
+def test_confidence_intervals():
+    """
+    the batched confidence intervals agree with the ones calculated node by node
+    """
+    from treetime import TreeTime
+    from Bio import Phylo, AlignIO
+    import numpy as np
+
+    nwk, alnstr, dates = dated_polytomy_example()
+    np.random.seed(1)
+    tt = TreeTime(tree=Phylo.read(StringIO(nwk), 'newick'), aln=AlignIO.read(StringIO(alnstr), 'fasta'),
+                  dates=dates, gtr='JC69', verbose=0)
+    tt.run(root='least-squares', max_iter=1, time_marginal=True, branch_length_mode='joint')
+
+    nodes = list(tt.tree.find_clades())
+    for interval in [(0.05, 0.95), (0.1, 0.5)]:
+        batched = tt.get_confidence_intervals(nodes, interval)
+        assert batched.shape == (len(nodes), 2)
+        for node, ci in zip(nodes, batched):
+            assert np.abs(ci - tt.get_confidence_interval(node, interval)).max() < 1e-8
+
+
+def test_base_chisq():
+    """
+    the vectorized chisq of several vectors of averages agrees with the chisq
+    returned by base_regression for each of them
+    """
+    from treetime.treeregression import base_regression, base_chisq
+    import numpy as np
+
+    np.random.seed(1)
+    # averages of tip values t and branch values d of random samples of different size
+    Q = []
+    for n in [3, 5, 10, 50]:
+        t = np.random.random(n)
+        d = 0.1*t + 0.01*np.random.random(n)
+        Q.append([t.sum(), d.sum(), (t**2).sum(), (d*t).sum(), (d**2).sum(), n])
+    Q = np.array(Q).T
+
+    chisq = base_chisq(Q)
+    assert chisq.shape == (Q.shape[1],)
+    for i in range(Q.shape[1]):
+        assert np.abs(chisq[i] - base_regression(Q[:,i])['chisq']) < 1e-14
+        assert np.abs(base_chisq(Q[:,i], slope=0.1) - base_regression(Q[:,i], slope=0.1)['chisq']) < 1e-14
+
+
+def test_branch_len_interpolator_copy():
+    """
+    an interpolator created from the interpolator of a branch without
+    mutations agrees with one computed for that branch
+    """
+    from treetime import TreeAnc
+    from treetime.branch_len_interpolator import BranchLenInterpolator
+    from Bio import Phylo, AlignIO
+    import numpy as np
+
+    tiny_tree = Phylo.read(StringIO("((A:0.001,B:0.002)AB:0.01,C:0.02);"), 'newick')
+    tiny_aln = AlignIO.read(StringIO(">A\nACGTACGTACGTACGTACGT\n"
+                                     ">B\nACGTACGTACGTACGTACGT\n"
+                                     ">C\nACGTACGTACGTACGAACGT\n"), 'fasta')
+    t = TreeAnc(tree=tiny_tree, aln=tiny_aln, gtr='Jukes-Cantor', verbose=0)
+    t.infer_ancestral_sequences(marginal=False)
+
+    # A and B carry the sequence of their parent
+    A, B = [t._leaves_lookup[name] for name in 'AB']
+    for node in [A, B]:
+        node.mutation_length = 0.0
+        t.add_branch_state(node)
+    ref = BranchLenInterpolator(B, t.gtr, one_mutation=t.one_mutation)
+    copy = BranchLenInterpolator.from_interpolator(B,
+                    BranchLenInterpolator(A, t.gtr, one_mutation=t.one_mutation))
+
+    assert copy.node is B
+    assert np.all(copy.x == ref.x)
+    x = np.linspace(0, 0.1, 51)
+    assert np.abs(copy.prob(x) - ref.prob(x)).max() < 1e-12
+    assert np.abs(copy(x) - ref(x)).max() < 1e-12
+
+
+def test_relaxed_clock_kernel():
+    """
+    the array based relaxed clock kernel reproduces the recursion over the
+    nodes of the tree
+    """
+    from treetime.treetime import _relaxed_clock_kernel
+    from Bio import Phylo
+    import numpy as np
+
+    tiny_tree = Phylo.read(StringIO("(((A:0.1,B:0.2)C:0.1,D:0.3,E:0.1)F:0.2,(G:0.3,H:0.1)I:0.1)J:0.01;"), 'newick')
+    nodes = list(tiny_tree.find_clades(order='postorder'))
+    index = {n:ni for ni, n in enumerate(nodes)}
+    parent = np.array([-1]*len(nodes))
+    for n in nodes:
+        for c in n.clades:
+            parent[index[c]] = index[n]
+
+    np.random.seed(1)
+    coupling = 0.5
+    k2 = 1 + np.random.random(len(nodes))
+    k1 = -2*(1 + np.random.random(len(nodes)))
+
+    # reference: postorder accumulation and preorder assignment node by node
+    ref_k1, ref_k2, ref_gamma = {}, {}, {}
+    for n in nodes:
+        ref_k1[n], ref_k2[n] = k1[index[n]], k2[index[n]]
+        for child in n.clades:
+            denom = coupling+ref_k2[child]
+            ref_k2[n] += coupling*(1.0-coupling/denom)**2 + ref_k2[child]*coupling**2/denom**2
+            ref_k1[n] += (coupling*(1.0-coupling/denom)*ref_k1[child]/denom \
+                        - coupling*ref_k1[child]*ref_k2[child]/denom**2 \
+                        + coupling*ref_k1[child]/denom)
+    for n in tiny_tree.find_clades(order='preorder'):
+        if n is tiny_tree.root:
+            ref_gamma[n] = max(0.1, -0.5*ref_k1[n]/ref_k2[n])
+        for child in n.clades:
+            ref_gamma[child] = max(0.1, (coupling*ref_gamma[n] - 0.5*ref_k1[child])/(coupling+ref_k2[child]))
+
+    gamma = np.ones(len(nodes))
+    _relaxed_clock_kernel(parent, k1, k2, gamma, coupling)
+    for n in nodes:
+        assert np.abs(k1[index[n]] - ref_k1[n]) < 1e-12
+        assert np.abs(k2[index[n]] - ref_k2[n]) < 1e-12
+        assert np.abs(gamma[index[n]] - ref_gamma[n]) < 1e-12
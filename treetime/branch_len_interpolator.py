@@ -103,6 +103,25 @@ class BranchLenInterpolator (Distribution):
         super(BranchLenInterpolator, self).__init__(grid, log_prob, is_log=True,
                                                     kind='linear', min_width=min_width)
 
+    @classmethod
+    def from_interpolator(cls, node, other):
+        """
+        Create an interpolator for node that shares the branch length distribution
+        of the interpolator other without evaluating the likelihood on the grid
+        again. This is only valid if the branches carry the same state pairs and
+        have the same mutation length, e.g. new branches without mutations.
+        """
+        if node.up is None:
+            raise Exception("Cannot create branch length interpolator for the root node.")
+        res = cls.__new__(cls)
+        res.node = node
+        res.gtr = other.gtr
+        res._gamma = 1.0
+        res._merger_cost = None
+        Distribution.__init__(res, np.copy(other.x), other.y, is_log=True,
+                              kind=other.kind, min_width=other.min_width, assume_sorted=True)
+        return res
+
 
     @property
     def gamma(self):
@@ -8,6 +8,19 @@ from .distribution import Distribution
 from .branch_len_interpolator import BranchLenInterpolator
 from .node_interpolator import NodeInterpolator
 
+def mean_date_constraint(node):
+    """
+    Mean of the sampling date constraint of a node, None if the node is not
+    constrained. Uses the value cached when the dates were assigned if available.
+    """
+    if hasattr(node, '_raw_date_mean'):
+        return node._raw_date_mean
+    elif getattr(node, 'raw_date_constraint', None) is not None:
+        return np.mean(node.raw_date_constraint)
+    else:
+        return None
+
+
 class ClockTree(TreeAnc):
     """
     ClockTree is the main class to perform the optimization of the node
@@ -78,6 +91,7 @@ class ClockTree(TreeAnc):
         self.rel_tol_refine = ttconf.REL_TOL_REFINE
         self.branch_length_mode = branch_length_mode
         self.clock_model=None
+        self._treg = None # cached TreeRegression instance, reset when the topology changes
         self.use_covariation=use_covariation # if false, covariation will be ignored in rate estimates.
         self._set_precision(precision)
         self._assign_dates()
@@ -101,19 +115,23 @@ class ClockTree(TreeAnc):
                 if np.isscalar(tmp_date) and np.isnan(tmp_date):
                     self.logger("WARNING: ClockTree.init: node %s has a bad date: %s"%(node.name, str(tmp_date)), 2, warn=True)
                     node.raw_date_constraint = None
+                    node._raw_date_mean = None
                     node.bad_branch = True
                 else:
                     try:
                         tmp = np.mean(tmp_date)
                         node.raw_date_constraint = tmp_date
+                        node._raw_date_mean = float(tmp)
                         node.bad_branch = False
                     except:
                         self.logger("WARNING: ClockTree.init: node %s has a bad date: %s"%(node.name, str(tmp_date)), 2, warn=True)
                         node.raw_date_constraint = None
+                        node._raw_date_mean = None
                         node.bad_branch = True
             else: # nodes without date contraints
 
                 node.raw_date_constraint = None
+                node._raw_date_mean = None
 
                 if node.is_terminal():
                     # Terminal branches without date constraints marked as 'bad'
@@ -191,9 +209,16 @@ class ClockTree(TreeAnc):
             self._date2dist = val
 
 
+    def _cache_traversals(self):
+        super(ClockTree, self)._cache_traversals()
+        # the topology might have changed, the tree regression needs to be set up again
+        self._treg = None
+
+
     def setup_TreeRegression(self, covariation=True):
         """instantiate a TreeRegression object and set its tip_value and branch_value function
-        to defaults that are sensible for treetime instances.
+        to defaults that are sensible for treetime instances. The TreeRegression instance
+        is reused until the tree topology changes, only the value functions are updated.
 
         Parameters
         ----------
@@ -205,7 +230,7 @@ class ClockTree(TreeAnc):
             a TreeRegression instance with self.tree attached as tree.
         """
         from .treeregression import TreeRegression
-        tip_value = lambda x:np.mean(x.raw_date_constraint) if (x.is_terminal() and (x.bad_branch is False)) else None
+        tip_value = lambda x:mean_date_constraint(x) if (x.is_terminal() and (x.bad_branch is False)) else None
         branch_value = lambda x:x.mutation_length
         if covariation:
             om = self.one_mutation
@@ -214,10 +239,15 @@ class ClockTree(TreeAnc):
         else:
             branch_variance = lambda x:1.0 if x.is_terminal() else 0.0
 
-        Treg = TreeRegression(self.tree, tip_value=tip_value,
-                             branch_value=branch_value, branch_variance=branch_variance)
-        Treg.valid_confidence = covariation
-        return Treg
+        if self._treg is None or self._treg.tree is not self.tree:
+            self._treg = TreeRegression(self.tree, tip_value=tip_value,
+                                        branch_value=branch_value, branch_variance=branch_variance)
+        else:
+            self._treg.tip_value = tip_value
+            self._treg.branch_value = branch_value
+            self._treg.branch_variance = branch_variance
+        self._treg.valid_confidence = covariation
+        return self._treg
 
 
     def get_clock_model(self, covariation=True, slope=None):
@@ -317,6 +347,7 @@ class ClockTree(TreeAnc):
                                 " Date constraint will be ignored!", 4, warn=True)
             else: # node without sampling date set
                 node.raw_date_constraint = None
+                node._raw_date_mean = None
                 node.date_constraint = None
 
 
@@ -697,7 +728,7 @@ class ClockTree(TreeAnc):
         if not hasattr(self.tree.root, 'numdate'):
             self.logger('ClockTree.branch_length_to_years: infer ClockTree first', 2,warn=True)
         self.tree.root.branch_length = 0.1
-        for n in self.tree.find_clades(order='preorder'):
+        for n in self._preorder:
             if n.up is not None:
                 n.branch_length = n.numdate - n.up.numdate
 
@@ -830,6 +861,54 @@ class ClockTree(TreeAnc):
         return self.combine_confidence(node.numdate, (min_date, max_date),
                                   c1=rate_contribution, c2=mutation_contribution)
 
+    def get_confidence_intervals(self, nodes, interval = (0.05, 0.95)):
+        '''
+        Confidence intervals of several nodes, see :py:meth:`get_confidence_interval`.
+        The inverse cumulative distributions of all nodes that only carry a marginal
+        distribution are evaluated in a single interpolation.
+
+        Parameters
+        ----------
+
+         nodes : list
+            The nodes for which the confidence intervals are to be calculated
+
+         interval : tuple, list
+            Array of length two, or tuple, defining the bounds of the confidence interval
+
+        Returns
+        -------
+
+         confidence_intervals : numpy array
+            Array of shape (len(nodes), 2) with the numerical dates delineating the
+            confidence interval of each node
+
+        '''
+        res = np.empty((len(nodes), 2))
+        batch = []
+        for ni, node in enumerate(nodes):
+            if hasattr(node, "marginal_inverse_cdf") and not hasattr(node, "numdate_rate_variation") \
+               and node.marginal_inverse_cdf!="delta":
+                batch.append(ni)
+            else:
+                res[ni] = self.get_confidence_interval(node, interval)
+
+        if batch:
+            # the cumulative distributions range from 0 to 1. Shifting the one of the
+            # k-th node by 2k allows to evaluate all of them in one call of np.interp
+            inverse_cdfs = [nodes[ni].marginal_inverse_cdf for ni in batch]
+            shift = 2.0*np.arange(len(batch))
+            cdf = np.concatenate([f.x + s for f, s in zip(inverse_cdfs, shift)])
+            pos = np.concatenate([f.y for f in inverse_cdfs])
+            mutation_contribution = self.date2dist.to_numdate(
+                            np.interp(np.array(interval)[::-1] + shift[:,None], cdf, pos))
+            limits = self.date2dist.to_numdate(np.array([(nodes[ni].marginal_pos_LH.xmax, nodes[ni].marginal_pos_LH.xmin)
+                                                         for ni in batch]))
+            res[batch,0] = np.maximum(limits[:,0], mutation_contribution[:,0])
+            res[batch,1] = np.minimum(limits[:,1], mutation_contribution[:,1])
+
+        return res
+
     def get_max_posterior_region(self, node, fraction = 0.9):
         '''
         If temporal reconstruction was done using the marginal ML mode, the entire distribution of
@@ -42,4 +42,11 @@ ERROR = "error"
 # autocorrelated molecular clock coefficients
 MU_ALPHA = 1
 MU_BETA = 1
+# number of grid points used to evaluate cost gains when resolving polytomies
+POLYTOMY_GRID_SIZE = 32
+# maximal number of elements of the temporary grid arrays when evaluating cost gains
+POLYTOMY_MAX_GRID_ELEMENTS = 2**22
+# factor by which the per-node tables of branch length interpolator values are
+# denser than the POLYTOMY_GRID_SIZE grid on which cost gains of node pairs are evaluated
+POLYTOMY_INTERPOLATION_REFINEMENT = 4
 
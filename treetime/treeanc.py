@@ -414,8 +414,9 @@ class TreeAnc(object):
         self.tree.root.up = None
         self.tree.root.tt = self
         self.tree.root.bad_branch=self.tree.root.bad_branch if hasattr(self.tree.root, 'bad_branch') else False
+        self._cache_traversals()
 
-        name_set = set([n.name for n in self.tree.find_clades() if n.name])
+        name_set = set([n.name for n in self._preorder if n.name])
         internal_node_count = 0
         for clade in self.tree.get_nonterminals(order='preorder'): # parents first
             if clade.name is None:
@@ -430,7 +431,7 @@ class TreeAnc(object):
                 c.up = clade
                 c.tt = self
 
-        for clade in self.tree.find_clades(order='postorder'): # children first
+        for clade in self._postorder: # children first
             if clade.is_terminal():
                 clade.bad_branch = clade.bad_branch if hasattr(clade, 'bad_branch') else False
             else:
@@ -440,6 +441,23 @@ class TreeAnc(object):
         self._internal_node_count = max(internal_node_count, self._internal_node_count)
 
 
+    def _cache_traversals(self):
+        """
+        Store the preorder and postorder traversals and the terminals of the tree as lists.
+        These are only valid until the next change of the tree topology and
+        are refreshed whenever the nodes are prepared. Each node is labeled
+        with its postorder position _idx, which can be used to index arrays
+        of per-node quantities.
+        """
+        self._preorder = list(self.tree.find_clades(order='preorder'))
+        self._postorder = list(self.tree.find_clades(order='postorder'))
+        self._terminals = [n for n in self._postorder if n.is_terminal()]
+        for ni, node in enumerate(self._postorder):
+            node._idx = ni
+
+
+
+
     def _calc_dist2root(self):
         """
         For each node in the tree, set its root-to-node distance as dist2root
@@ -1326,6 +1344,7 @@ class TreeAnc(object):
         from the tree. **Requires** ancestral sequence reconstruction
         """
         self.logger("TreeAnc.prune_short_branches: pruning short branches (max prob at zero)...", 1)
+        pruned = False
         for node in self.tree.find_clades():
             if node.up is None or node.is_terminal():
                 continue
@@ -1338,6 +1357,9 @@ class TreeAnc(object):
                 node.up.clades = [k for k in node.up.clades if k != node] + node.clades
                 for clade in node.clades:
                     clade.up = node.up
+                pruned = True
+        if pruned:
+            self._cache_traversals()
 
 
 #####################################################################
@@ -35,10 +35,7 @@ def base_regression(Q, slope=None):
         only_intercept=True
 
     intercept = (Q[davgii] - Q[tavgii]*slope)/Q[sii]
-    if (Q[tsqii] - Q[tavgii]**2/Q[sii])>0:
-        chisq = 0.5*(Q[dsqii] - Q[davgii]**2/Q[sii] - (Q[dtavgii] - Q[davgii]*Q[tavgii]/Q[sii])**2/(Q[tsqii] - Q[tavgii]**2/Q[sii]))
-    else:
-        chisq = 0.5*(Q[dsqii] - Q[davgii]**2/Q[sii])
+    chisq = base_chisq(Q, slope=slope, validate=False)
 
     if only_intercept:
         return {'slope':slope, 'intercept':intercept,
@@ -51,6 +48,40 @@ def base_regression(Q, slope=None):
             'cov':np.linalg.inv(estimator_hessian)}
 
 
+def base_chisq(Q, slope=None, validate=True):
+    """
+    chisq of the regression as calculated by base_regression, for a vector
+    or for an array of shape (6, k) whose columns are vectors of averages.
+
+    Parameters
+    ----------
+    Q : numpy.array
+        vector or array with the averages of tip and branch quantities
+    slope : None, optional
+        if not None, the slope of the regression is fixed
+    validate : bool, optional
+        if False, skip the checks of the input, for callers that did them already
+
+    Returns
+    -------
+    float, numpy.array
+        chisq for each of the vectors
+    """
+    if validate and (np.isinf(Q).sum() or np.isnan(Q).sum()):
+        raise ValueError("Invalid values in input data!")
+
+    t_var = Q[tsqii] - Q[tavgii]**2/Q[sii]
+    if validate and slope is None and np.any(t_var<=0):
+        raise ValueError("No variation in sampling dates! Please specify your clock rate explicitly.")
+
+    chisq = Q[dsqii] - Q[davgii]**2/Q[sii]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chisq_cov = chisq - (Q[dtavgii] - Q[davgii]*Q[tavgii]/Q[sii])**2/t_var
+    chisq = 0.5*np.where(t_var>0, chisq_cov, chisq)
+    # a single vector of averages yields a scalar
+    return chisq if chisq.ndim else chisq[()]
+
+
 class TreeRegression(object):
     """TreeRegression
     This class implements an efficient regression method
@@ -239,22 +270,24 @@ class TreeRegression(object):
             for propagation
          tv : (float)
             tip value. Only required if not is terminal
-         bl : (float)
+         bl : (float, np.array)
             branch value. The increment of the tree associated quantity'
 
-         var : (float)
-            the variance increment along the branch
+         var : (float, np.array)
+            the variance increment along the branch. bv and var can be arrays
+            of the same shape to propagate several values at once.
 
         Returns
         -------
          Q : (np.array)
-            a vector of length 6 containing the updated quantities
+            a vector of length 6 containing the updated quantities, or
+            an array of shape (6,)+var.shape if arrays are propagated
         """
         if n.is_terminal() and outgroup==False:
             if tv is None or np.isinf(tv) or np.isnan(tv):
-                res = np.array([0, 0, 0, 0, 0, 0])
-            elif var==0:
-                res = np.array([np.inf, np.inf, np.inf, np.inf, np.inf, np.inf])
+                res = np.zeros((6,)+np.shape(var))
+            elif np.any(var==0):
+                res = np.inf*np.ones((6,)+np.shape(var))
             else:
                 res = np.array([
                     tv/var,
@@ -381,9 +414,10 @@ class TreeRegression(object):
     def _optimal_root_along_branch(self, n, tv, bv, var, slope=None):
         from scipy.optimize import minimize_scalar
         def chisq(x):
+            # x can be an array of positions along the branch
             tmpQ = self.propagate_averages(n, tv, bv*x, var*x) \
                  + self.propagate_averages(n, tv, bv*(1-x), var*(1-x), outgroup=True)
-            return base_regression(tmpQ, slope=slope)['chisq']
+            return base_chisq(tmpQ, slope=slope)
 
         if n.bad_branch or (n!=self.tree.root and n.up.bad_branch):
             return np.nan, np.inf
@@ -393,7 +427,7 @@ class TreeRegression(object):
         chisq_dist = np.inf if n==self.tree.root else base_regression(n.up.Qtot, slope=slope)['chisq']
 
         grid = np.linspace(0.001,0.999,6)
-        chisq_grid = np.array([chisq(x) for x in grid])
+        chisq_grid = chisq(grid)
         min_chisq = chisq_grid.min()
         if chisq_prox<=min_chisq:
             return 0.0, chisq_prox
@@ -4,8 +4,7 @@ from scipy import optimize as sciopt
 from Bio import Phylo
 from treetime import config as ttconf
 from treetime import MissingDataError,UnknownMethodError,NotReadyError
-from .utils import tree_layout
-from .clock_tree import ClockTree
+from .clock_tree import ClockTree, mean_date_constraint
 
 rerooting_mechanisms = ["min_dev", "best", "least-squares"]
 deprecated_rerooting_mechanisms = {"residual":"least-squares", "res":"least-squares",
@@ -153,7 +152,6 @@ class TreeTime(ClockTree):
         else:
             self.optimize_tree(infer_gtr=infer_gtr,
                                max_iter=1, prune_short=True, **seq_kwargs)
-        avg_root_to_tip = np.mean([x.dist2root for x in self.tree.get_terminals()])
 
         # optionally reroot the tree either by oldest, best regression or with a specific leaf
         if n_iqd or root=='clock_filter':
@@ -256,7 +254,7 @@ class TreeTime(ClockTree):
             self.make_time_tree(**tt_kwargs)
 
         # explicitly print out which branches are bad and whose dates don't correspond to the input dates
-        bad_branches =[n for n in self.tree.get_terminals()
+        bad_branches =[n for n in self._terminals
                        if n.bad_branch and n.raw_date_constraint]
         if bad_branches:
             self.logger("TreeTime: The following tips don't fit the clock model, "
@@ -282,8 +280,7 @@ class TreeTime(ClockTree):
         if branch_length_mode in ['joint', 'marginal', 'input']:
             self.branch_length_mode = branch_length_mode
         elif self.aln:
-            bl_dis = [n.branch_length for n in self.tree.find_clades() if n.up]
-            max_bl = np.max(bl_dis)
+            max_bl = max(n.branch_length for n in self._preorder if n.up is not None)
             if max_bl>0.1:
                 bl_mode = 'input'
             else:
@@ -321,7 +318,6 @@ class TreeTime(ClockTree):
         if type(reroot) is list and len(reroot)==1:
             reroot=str(reroot[0])
 
-        terminals = self.tree.get_terminals()
         if reroot:
             self.reroot(root='least-squares' if reroot=='best' else reroot, covariation=False, clock_rate=fixed_clock_rate)
         else:
@@ -329,21 +325,21 @@ class TreeTime(ClockTree):
 
         clock_rate = self.clock_model['slope']
         icpt = self.clock_model['intercept']
-        res = {}
-        for node in terminals:
-            if hasattr(node, 'raw_date_constraint') and  (node.raw_date_constraint is not None):
-                res[node] = node.dist2root - clock_rate*np.mean(node.raw_date_constraint) - icpt
-
-        residuals = np.array(list(res.values()))
-        iqd = np.percentile(residuals,75) - np.percentile(residuals,25)
-        bad_branch_count = 0
-        for node,r in res.items():
-            if abs(r)>n_iqd*iqd and node.up.up is not None:
+        dated_terminals = [n for n in self._terminals if getattr(n, 'raw_date_constraint', None) is not None]
+        n_dated = len(dated_terminals)
+        dates = np.fromiter((mean_date_constraint(n) for n in dated_terminals), dtype=float, count=n_dated)
+        dist2root = np.fromiter((n.dist2root for n in dated_terminals), dtype=float, count=n_dated)
+        residuals = dist2root - clock_rate*dates - icpt
+
+        q25, q75 = np.quantile(residuals, [0.25, 0.75])
+        iqd = q75 - q25
+        # terminals attached to the root are never marked as outliers
+        outliers = (np.abs(residuals)>n_iqd*iqd) & np.array([n.up.up is not None for n in dated_terminals], dtype=bool)
+        for node, is_outlier, r in zip(dated_terminals, outliers, residuals):
+            if is_outlier:
                 self.logger('TreeTime.ClockFilter: marking %s as outlier, residual %f interquartile distances'%(node.name,r/iqd), 3, warn=True)
-                node.bad_branch=True
-                bad_branch_count += 1
-            else:
-                node.bad_branch=False
+            node.bad_branch = bool(is_outlier)
+        bad_branch_count = outliers.sum()
 
         if bad_branch_count>0.34*self.tree.count_terminals():
             self.logger("TreeTime.clock_filter: More than a third of leaves have been excluded by the clock filter. Please check your input data.", 0, warn=True)
@@ -421,8 +417,8 @@ class TreeTime(ClockTree):
         old_root = self.tree.root
 
         self.logger("TreeTime.reroot: with method or node: %s"%root,0)
-        for n in self.tree.find_clades():
-            n.branch_length=n.mutation_length
+        for n in self._postorder:
+            n.branch_length = n.mutation_length
 
         if (type(root) is str) and \
            (root in rerooting_mechanisms or root in deprecated_rerooting_mechanisms):
@@ -445,9 +441,9 @@ class TreeTime(ClockTree):
             elif root in self._leaves_lookup:
                 new_root = self._leaves_lookup[root]
             elif root=='oldest':
-                new_root = sorted([n for n in self.tree.get_terminals()
-                                   if n.raw_date_constraint is not None],
-                                   key=lambda x:np.mean(x.raw_date_constraint))[0]
+                new_root = min([n for n in self._terminals
+                                if n.raw_date_constraint is not None],
+                               key=mean_date_constraint)
             else:
                 raise UnknownMethodError('TreeTime.reroot -- ERROR: unsupported rooting mechanisms or root not found')
 
@@ -455,6 +451,7 @@ class TreeTime(ClockTree):
             #(Without outgroup_branch_length, gives a trifurcating root, but this will mean
             #mutations may have to occur multiple times.)
             self.tree.root_with_outgroup(new_root, outgroup_branch_length=new_root.branch_length/2)
+            self._treg = None
             self.get_clock_model(covariation=use_cov, slope = slope)
 
 
@@ -464,6 +461,7 @@ class TreeTime(ClockTree):
         self.tree.root.branch_length = self.one_mutation
         self.tree.root.clock_length = self.one_mutation
         self.tree.root.raw_date_constraint = None
+        self.tree.root._raw_date_mean = None
         if hasattr(new_root, 'time_before_present'):
             self.tree.root.time_before_present = new_root.time_before_present
         if hasattr(new_root, 'numdate'):
@@ -507,19 +505,28 @@ class TreeTime(ClockTree):
         """
         self.logger("TreeTime.resolve_polytomies: resolving multiple mergers...",1)
         poly_found=0
+        # branches that are longer in time than their mutations suggest, indexed by node._idx
+        is_stretched = np.array([n.up is not None and n.mutation_length < n.clock_length
+                                 for n in self._postorder], dtype=bool)
 
-        for n in self.tree.find_clades():
+        for n in self._preorder:
             if len(n.clades) > 2:
                 prior_n_clades = len(n.clades)
-                self._poly(n, merge_compressed)
+                self._poly(n, merge_compressed, is_stretched=is_stretched)
                 poly_found+=prior_n_clades - len(n.clades)
 
         obsolete_nodes = [n for n in self.tree.find_clades() if len(n.clades)==1 and n.up is not None]
         for node in obsolete_nodes:
             self.logger('TreeTime.resolve_polytomies: remove obsolete node '+node.name,4)
             if node.up is not None:
+                for c in node.clades:
+                    c.up = node.up
                 self.tree.collapse(node)
 
+        # the topology has changed, the cached traversals are stale
+        if poly_found or obsolete_nodes:
+            self._cache_traversals()
+
         if poly_found:
             self.logger('TreeTime.resolve_polytomies: introduces %d new nodes'%poly_found,3)
         else:
@@ -527,7 +534,7 @@ class TreeTime(ClockTree):
         return poly_found
 
 
-    def _poly(self, clade, merge_compressed):
+    def _poly(self, clade, merge_compressed, is_stretched=None):
 
         """
         Function to resolve polytomies for a given parent node. If the
@@ -553,13 +560,14 @@ class TreeTime(ClockTree):
             cg_new = - zero_branch_slope * (parent.time_before_present - t) # loss in LH due to the new branch
             return -(cg2+cg1+cg_new)
 
-        def cost_gain(n1, n2, parent):
+        def cost_gain(n1, n2, parent, bounds=None):
             """
             cost gained if the two nodes would have been connected.
             """
+            if bounds is None:
+                bounds = [max(n1.time_before_present,n2.time_before_present), parent.time_before_present]
             try:
-                cg = sciopt.minimize_scalar(_c_gain,
-                    bounds=[max(n1.time_before_present,n2.time_before_present), parent.time_before_present],
+                cg = sciopt.minimize_scalar(_c_gain, bounds=bounds,
                     method='Bounded',args=(n1,n2, parent))
                 return cg['x'], - cg['fun']
             except:
@@ -567,25 +575,116 @@ class TreeTime(ClockTree):
                 return parent.time_before_present, 0.0
 
 
+        def grid_evaluations(nodes, parent):
+            """
+            evaluate the branch length interpolators of the nodes once on a
+            grid of positions of their parent between the node and the parent.
+            Returns the node positions and arrays of grid positions and
+            interpolator values of shape (len(nodes), n_points).
+            """
+            t_parent = parent.time_before_present
+            tbp = np.array([n.time_before_present for n in nodes])
+            s_grid = np.linspace(0, 1, ttconf.POLYTOMY_GRID_SIZE*ttconf.POLYTOMY_INTERPOLATION_REFINEMENT + 1)
+            t_grid = tbp[:,None] + s_grid*(t_parent - tbp)[:,None]
+            values = np.array([n.branch_length_interpolator(tg - n.time_before_present)
+                               for n, tg in zip(nodes, t_grid)])
+            return tbp, t_grid, values
+
+        def grid_cost_gains(rows, cols, tbp, node_grid, node_values, parent):
+            """
+            approximate cost gains for connecting each node in rows with each
+            node in cols, where nodes are indices into the arrays returned by
+            grid_evaluations. For each pair, the gain is evaluated on a grid of
+            positions of the new node between the older of the two nodes and the
+            parent and refined by a parabolic fit around the best grid point.
+            Returns arrays of new node positions and cost gains of shape
+            (len(rows), len(cols)).
+            """
+            # the grid evaluation needs temporary arrays of shape (rows, cols, grid),
+            # the rows are processed in blocks to bound their size
+            rows = np.asarray(rows)
+            block = max(1, ttconf.POLYTOMY_MAX_GRID_ELEMENTS//(max(1, len(cols))*ttconf.POLYTOMY_GRID_SIZE))
+            results = [block_cost_gains(rows[i:i+block], cols, tbp, node_grid, node_values, parent)
+                       for i in range(0, len(rows), block)]
+            return (np.concatenate([r[0] for r in results]),
+                    np.concatenate([r[1] for r in results]))
+
+        def block_cost_gains(rows, cols, tbp, node_grid, node_values, parent):
+            """
+            cost gains of a block of rows, see grid_cost_gains
+            """
+            t_parent = parent.time_before_present
+            lower = np.maximum.outer(tbp[rows], tbp[cols])
+            # the gain vanishes if the new node is placed at the parent, exclude this point
+            s_grid = np.linspace(0, 1, ttconf.POLYTOMY_GRID_SIZE+1)[:-1]
+            t_grid = lower[:,:,None] + s_grid*(t_parent - lower)[:,:,None]
+
+            # the last grid value of each node is its cost with the current placement at the parent
+            gains = -zero_branch_slope * (t_parent - t_grid) # loss in LH due to the new branch
+            for i1, ni in enumerate(rows):
+                gains[i1] += node_values[ni,-1] - np.interp(t_grid[i1], node_grid[ni], node_values[ni])
+            for i2, ni in enumerate(cols):
+                gains[:,i2] += node_values[ni,-1] - np.interp(t_grid[:,i2], node_grid[ni], node_values[ni])
+
+            best = gains.argmax(axis=2)
+            mid = np.clip(best, 1, len(s_grid)-2)
+            ri, ci = np.indices(best.shape)
+            y0, y1, y2 = [gains[ri, ci, mid+d] for d in [-1,0,1]]
+            positions = t_grid[ri, ci, best]
+            max_gains = gains[ri, ci, best]
+
+            # the grid is equally spaced for each pair: vertex of the parabola through the three points
+            curvature = y0 - 2*y1 + y2
+            refine = (best==mid) & (curvature<0)
+            shift = 0.5*(y0[refine] - y2[refine])/curvature[refine]
+            positions[refine] += shift*s_grid[1]*(t_parent - lower[refine])
+            max_gains[refine] -= 0.25*(y0[refine] - y2[refine])*shift
+            return positions, max_gains
+
+
         def merge_nodes(source_arr, isall=False):
-            mergers = np.array([[cost_gain(n1,n2, clade) if i1<i2 else (0.0,-1.0)
-                                    for i1,n1 in enumerate(source_arr)]
-                                for i2, n2 in enumerate(source_arr)])
+            if len(source_arr) <= 1 + int(isall):
+                return 0
+            # the interpolators are evaluated once per node, the grid estimates
+            # of the cost gains are obtained from these values
+            tbp, node_grid, node_values = grid_evaluations(source_arr, clade)
+            all_idxs = np.arange(len(source_arr))
+            positions, gains = grid_cost_gains(all_idxs, all_idxs, tbp, node_grid, node_values, clade)
+            # only consider each pair once
+            gains[np.triu_indices_from(gains)] = -1.0
+            positions[np.triu_indices_from(positions)] = 0.0
+            mergers = np.stack((positions, gains), axis=2)
+            # max possible gains of the cost when connecting the nodes:
+            # this is only a rough approximation because it assumes the new node positions
+            # to be optimal
+            new_positions = mergers[:,:,0]
+            cost_gains = mergers[:,:,1]
+            # set zero to large negative value
+            np.fill_diagonal(cost_gains, -1e11)
+            # merged nodes take the place of one of their children in the
+            # matrix, the slot of the other child is retired
+            alive = np.ones(len(source_arr), dtype=bool)
+            n_alive = len(source_arr)
+            # all new nodes carry the sequence of the parent and no mutations, their
+            # branch length interpolators are identical and only computed once
+            zero_branch_interpolator = None
             LH = 0
-            while len(source_arr) > 1 + int(isall):
-                # max possible gains of the cost when connecting the nodes:
-                # this is only a rough approximation because it assumes the new node positions
-                # to be optimal
-                new_positions = mergers[:,:,0]
-                cost_gains = mergers[:,:,1]
-                # set zero to large negative value and find optimal pair
-                np.fill_diagonal(cost_gains, -1e11)
+            while n_alive > 1 + int(isall):
+                # find optimal pair
                 idxs = np.unravel_index(cost_gains.argmax(),cost_gains.shape)
                 if (idxs[0] == idxs[1]) or cost_gains.max()<0:
                     self.logger("TreeTime._poly.merge_nodes: node is not fully resolved "+clade.name,4)
                     return LH
 
                 n1, n2 = source_arr[idxs[0]], source_arr[idxs[1]]
+                # refine the position of the new node in the vicinity of the grid estimate
+                lower = max(n1.time_before_present, n2.time_before_present)
+                dt = (clade.time_before_present - lower)/ttconf.POLYTOMY_GRID_SIZE
+                bounds = [max(lower, new_positions[idxs]-dt), min(clade.time_before_present, new_positions[idxs]+dt)]
+                new_positions[idxs], cost_gains[idxs] = cost_gain(n1, n2, clade, bounds=bounds)
+                if cost_gains[idxs]<0: # grid estimate was too optimistic, try the next best pair
+                    continue
+
                 LH += cost_gains[idxs]
 
                 new_node = Phylo.BaseTree.Clade()
@@ -607,40 +706,43 @@ class TreeTime(ClockTree):
                     self.add_branch_state(new_node)
 
                 new_node.mutation_length = 0.0
-                new_node.branch_length_interpolator = BranchLenInterpolator(new_node, self.gtr, one_mutation=self.one_mutation,
-                                                                            branch_length_mode = self.branch_length_mode)
+                if zero_branch_interpolator is None:
+                    zero_branch_interpolator = BranchLenInterpolator(new_node, self.gtr, one_mutation=self.one_mutation,
+                                                                     branch_length_mode = self.branch_length_mode)
+                    new_node.branch_length_interpolator = zero_branch_interpolator
+                else:
+                    new_node.branch_length_interpolator = BranchLenInterpolator.from_interpolator(new_node,
+                                                                                                  zero_branch_interpolator)
                 clade.clades.remove(n1)
                 clade.clades.remove(n2)
                 clade.clades.append(new_node)
                 self.logger('TreeTime._poly.merge_nodes: creating new node as child of '+clade.name,3)
                 self.logger("TreeTime._poly.merge_nodes: Delta-LH = " + str(cost_gains[idxs].round(3)), 3)
 
-                # and modify source_arr array for the next loop
-                if len(source_arr)>2: # if more than 3 nodes in polytomy, replace row/column
-                    for ii in np.sort(idxs)[::-1]:
-                        tmp_ind = np.arange(mergers.shape[0])!=ii
-                        mergers = mergers[tmp_ind].swapaxes(0,1)
-                        mergers = mergers[tmp_ind].swapaxes(0,1)
-
-                    source_arr.remove(n1)
-                    source_arr.remove(n2)
-                    new_gains = np.array([[cost_gain(n1,new_node, clade) for n1 in source_arr]])
-                    mergers = np.vstack((mergers, new_gains)).swapaxes(0,1)
-
-                    source_arr.append(new_node)
-                    new_gains = np.array([[cost_gain(n1,new_node, clade) for n1 in source_arr]])
-                    mergers = np.vstack((mergers, new_gains)).swapaxes(0,1)
-                else: # otherwise just recalculate matrix
-                    source_arr.remove(n1)
-                    source_arr.remove(n2)
-                    source_arr.append(new_node)
-                    mergers = np.array([[cost_gain(n1,n2, clade) for n1 in source_arr]
-                                       for n2 in source_arr])
+                # and modify the merger matrix for the next loop
+                source_arr[idxs[0]] = new_node
+                alive[idxs[1]] = False
+                n_alive -= 1
+                cost_gains[idxs[1],:] = -1e11
+                cost_gains[:,idxs[1]] = -1e11
+                if n_alive > 1 + int(isall):
+                    new_tbp, new_grid, new_values = grid_evaluations([new_node], clade)
+                    tbp[idxs[0]] = new_tbp[0]
+                    node_grid[idxs[0]] = new_grid[0]
+                    node_values[idxs[0]] = new_values[0]
+                    others = np.flatnonzero(alive & (all_idxs!=idxs[0]))
+                    new_gains = np.stack(grid_cost_gains([idxs[0]], others, tbp, node_grid, node_values, clade), axis=2)[0]
+                    mergers[idxs[0], others] = new_gains
+                    mergers[others, idxs[0]] = new_gains
 
             return LH
 
-        stretched = [c for c  in clade.clades if c.mutation_length < c.clock_length]
-        compressed = [c for c in clade.clades if c not in stretched]
+        if is_stretched is None:
+            child_stretched = [c.mutation_length < c.clock_length for c in clade.clades]
+        else:
+            child_stretched = is_stretched[[c._idx for c in clade.clades]]
+        stretched = [c for c, s in zip(clade.clades, child_stretched) if s]
+        compressed = [c for c, s in zip(clade.clades, child_stretched) if not s]
 
         if len(stretched)==1 and merge_compressed is False:
             return 0.0
@@ -648,7 +750,6 @@ class TreeTime(ClockTree):
         LH = merge_nodes(stretched, isall=len(stretched)==len(clade.clades))
         if merge_compressed and len(compressed)>1:
             LH += merge_nodes(compressed, isall=len(compressed)==len(clade.clades))
-
         return LH
 
 
@@ -735,36 +836,27 @@ class TreeTime(ClockTree):
         self.logger("TreeTime.relaxed_clock: slack=%f, coupling=%f"%(slack, coupling),2)
 
         c=1.0/self.one_mutation
-        for node in self.tree.find_clades(order='postorder'):
-            opt_len = node.mutation_length
-            act_len = node.clock_length if hasattr(node, 'clock_length') else node.branch_length
-
-            # opt_len \approx 1.0*len(node.mutations)/node.profile.shape[0] but calculated via gtr model
-            # stiffness is the expectation of the inverse variance of branch length (one_mutation/opt_len)
-            # contact term: stiffness*(g*bl - bl_opt)^2 + slack(g-1)^2 =
-            #               (slack+bl^2) g^2 - 2 (bl*bl_opt+1) g + C= k2 g^2 + k1 g + C
-            node._k2 = slack + c*act_len**2/(opt_len+self.one_mutation)
-            node._k1 = -2*(c*act_len*opt_len/(opt_len+self.one_mutation) + slack)
-            # coupling term: \sum_c coupling*(g-g_c)^2 + Cost_c(g_c|g)
-            # given g, g_c needs to be optimal-> 2*coupling*(g-g_c) = 2*child.k2 g_c  + child.k1
-            # hence g_c = (coupling*g - 0.5*child.k1)/(coupling+child.k2)
-            # substituting yields
-            for child in node.clades:
-                denom = coupling+child._k2
-                node._k2 += coupling*(1.0-coupling/denom)**2 + child._k2*coupling**2/denom**2
-                node._k1 += (coupling*(1.0-coupling/denom)*child._k1/denom \
-                            - coupling*child._k1*child._k2/denom**2 \
-                            + coupling*child._k1/denom)
-
-        for node in self.tree.find_clades(order='preorder'):
+        nodes = self._postorder
+        parent = np.array([-1 if n.up is None else n.up._idx for n in nodes], dtype=int)
+        opt_len = np.array([n.mutation_length for n in nodes], dtype=float)
+        act_len = np.array([n.clock_length if hasattr(n, 'clock_length') else n.branch_length
+                            for n in nodes], dtype=float)
+
+        # opt_len \approx 1.0*len(node.mutations)/node.profile.shape[0] but calculated via gtr model
+        # stiffness is the expectation of the inverse variance of branch length (one_mutation/opt_len)
+        # contact term: stiffness*(g*bl - bl_opt)^2 + slack(g-1)^2 =
+        #               (slack+bl^2) g^2 - 2 (bl*bl_opt+1) g + C= k2 g^2 + k1 g + C
+        k2 = slack + c*act_len**2/(opt_len+self.one_mutation)
+        k1 = -2*(c*act_len*opt_len/(opt_len+self.one_mutation) + slack)
+        gamma = np.ones_like(k1)
+        _relaxed_clock_kernel(parent, k1, k2, gamma, coupling)
+
+        for node, g in zip(nodes, gamma):
             if node.up is None:
-                node.gamma = max(0.1, -0.5*node._k1/node._k2)
+                node.gamma = g
             else:
-                if node.up.up is None:
-                    g_up = node.up.gamma
-                else:
-                    g_up = node.up.branch_length_interpolator.gamma
-                node.branch_length_interpolator.gamma = max(0.1,(coupling*g_up - 0.5*node._k1)/(coupling+node._k2))
+                node.branch_length_interpolator.gamma = g
+
 
 ###############################################################################
 ### rerooting
@@ -788,14 +880,104 @@ class TreeTime(ClockTree):
             only accept positive evolutionary rate estimates when rerooting the tree
 
         '''
-        for n in self.tree.find_clades():
+        for n in self._preorder:
             n.branch_length=n.mutation_length
         self.logger("TreeTime._find_best_root: searching for the best root position...",2)
         Treg = self.setup_TreeRegression(covariation=covariation)
-        return Treg.optimal_reroot(force_positive=force_positive, slope=slope)['node']
+        new_root = Treg.optimal_reroot(force_positive=force_positive, slope=slope)['node']
+        # rerooting changed the topology, the regression has to be set up again
+        self._treg = None
+        return new_root
 
 
-def plot_vs_years(tt, step = None, ax=None, confidence=None, ticks=True, **kwargs):
+def _relaxed_clock_kernel(parent, k1, k2, gamma, coupling):
+    """
+    Propagate the quadratic cost coefficients k1, k2 of the relaxed clock from
+    the tips to the root and assign the optimal rate multipliers gamma from the
+    root to the tips. Nodes are expected in postorder, with parent[i] the index
+    of the parent of node i (-1 for the root). k1, k2, and gamma are modified in place.
+    The loop is deliberately plain Python: for trees of up to several thousand
+    nodes it finishes before a cached numba compilation of it would have loaded.
+    """
+    # coupling term: \sum_c coupling*(g-g_c)^2 + Cost_c(g_c|g)
+    # given g, g_c needs to be optimal-> 2*coupling*(g-g_c) = 2*child.k2 g_c  + child.k1
+    # hence g_c = (coupling*g - 0.5*child.k1)/(coupling+child.k2)
+    # substituting yields
+    for ni in range(len(parent)):
+        pi = parent[ni]
+        if pi<0:
+            continue
+        denom = coupling+k2[ni]
+        k2[pi] += coupling*(1.0-coupling/denom)**2 + k2[ni]*coupling**2/denom**2
+        k1[pi] += (coupling*(1.0-coupling/denom)*k1[ni]/denom \
+                    - coupling*k1[ni]*k2[ni]/denom**2 \
+                    + coupling*k1[ni]/denom)
+
+    # reverse postorder visits parents before their children
+    for ni in range(len(parent)-1, -1, -1):
+        pi = parent[ni]
+        if pi<0:
+            gamma[ni] = max(0.1, -0.5*k1[ni]/k2[ni])
+        else:
+            gamma[ni] = max(0.1, (coupling*gamma[pi] - 0.5*k1[ni])/(coupling+k2[ni]))
+
+
+def _tree_layout(tree):
+    """
+    Vertical positions of the nodes as assigned by utils.tree_layout, computed
+    from the current order of the clades. Returns the nodes in postorder, their
+    positions, the index of the parent of each node (-1 for the root), and the
+    indices of the internal nodes and of their first and last children.
+    """
+    nodes = list(tree.find_clades(order='postorder'))
+    ypos = np.zeros(len(nodes))
+    parent = -np.ones(len(nodes), dtype=int)
+    index = {}
+    internal_idx, first, last = [], [], []
+    leaf_count = 0
+    # postorder: children are placed before their parents
+    for ni, n in enumerate(nodes):
+        index[id(n)] = ni
+        if n.is_terminal():
+            leaf_count += 1
+            ypos[ni] = leaf_count
+        else:
+            child_idx = [index[id(c)] for c in n.clades]
+            parent[child_idx] = ni
+            internal_idx.append(ni)
+            first.append(child_idx[0])
+            last.append(child_idx[-1])
+            ypos[ni] = 0.5*(ypos[child_idx[0]] + ypos[child_idx[-1]])
+    for n, y in zip(nodes, ypos.tolist()):
+        n.ypos = y
+    return nodes, ypos, parent, np.array(internal_idx, dtype=int), \
+           np.array(first, dtype=int), np.array(last, dtype=int)
+
+
+def _draw_tree_segments(tt, ax, offset):
+    """
+    Draw the branches of the time tree as a single LineCollection, using the
+    same layout as Phylo.draw. No labels are drawn.
+    """
+    from matplotlib import rcParams
+    from matplotlib.collections import LineCollection
+    nodes, ypos, parent, internal_idx, first, last = _tree_layout(tt.tree)
+    xpos = np.fromiter((n.numdate for n in nodes), dtype=float, count=len(nodes)) - offset
+
+    # horizontal lines from the parent to each node, vertical lines spanning the children
+    segments = np.empty((len(nodes)+len(internal_idx), 2, 2))
+    segments[:len(nodes),0,0] = np.where(parent>=0, xpos[parent], 0)
+    segments[:len(nodes),1,0] = xpos
+    segments[:len(nodes),:,1] = ypos[:,None]
+    segments[len(nodes):,:,0] = xpos[internal_idx,None]
+    segments[len(nodes):,0,1] = ypos[first]
+    segments[len(nodes):,1,1] = ypos[last]
+    ax.add_collection(LineCollection(segments, colors='k', linewidths=rcParams['lines.linewidth']))
+    ax.set_xlim(-0.05*xpos.max(), 1.25*xpos.max())
+    ax.set_ylim(ypos.max()+0.8, 0.2)
+
+
+def plot_vs_years(tt, step = None, ax=None, confidence=None, ticks=True, fast_plot=False, **kwargs):
     '''
     Converts branch length to years and plots the time tree on a time axis.
 
@@ -816,26 +998,41 @@ def plot_vs_years(tt, step = None, ax=None, confidence=None, ticks=True, **kwarg
         Confidence intervals are either specified as an interval of the posterior distribution
         like (0.05, 0.95) or as the weight of the maximal posterior region , e.g. 0.9
 
+     fast_plot : bool
+        Draw all branches as one line collection instead of using Phylo.draw.
+        This is much faster for large trees. The layout is that of Phylo.draw,
+        but line joins can be rendered slightly differently. No labels are drawn
+        and kwargs are ignored.
+
      **kwargs : dict
         Key word arguments that are passed down to Phylo.draw
 
     '''
     import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
+    from matplotlib.collections import PatchCollection, LineCollection
     tt.branch_length_to_years()
-    nleafs = tt.tree.count_terminals()
+    terminals = tt._terminals
+    nleafs = len(terminals)
 
     if ax is None:
         fig = plt.figure(figsize=(12,10))
         ax = plt.subplot(111)
     else:
         fig = None
+    offset = tt.tree.root.numdate - tt.tree.root.branch_length
     # draw tree
-    if "label_func" not in kwargs:
-        kwargs["label_func"] = lambda x:x.name if (x.is_terminal() and nleafs<30) else ""
-    Phylo.draw(tt.tree, axes=ax, **kwargs)
+    if fast_plot:
+        if kwargs:
+            tt.logger("plot_vs_years: fast_plot ignores the arguments for Phylo.draw: "
+                      +", ".join(sorted(kwargs)), 1, warn=True)
+        _draw_tree_segments(tt, ax, offset)
+    else:
+        if "label_func" not in kwargs:
+            kwargs["label_func"] = lambda x:x.name if (x.is_terminal() and nleafs<30) else ""
+        Phylo.draw(tt.tree, axes=ax, **kwargs)
 
-    offset = tt.tree.root.numdate - tt.tree.root.branch_length
-    date_range = np.max([n.numdate for n in tt.tree.get_terminals()])-offset
+    date_range = np.fromiter((n.numdate for n in terminals), dtype=float, count=nleafs).max()-offset
 
     # estimate year intervals if not explicitly specified
     if step is None or (step>0 and date_range/step>100):
@@ -854,17 +1051,17 @@ def plot_vs_years(tt, step = None, ax=None, confidence=None, ticks=True, **kwarg
         tick_vals = np.arange(min_tick, min_tick+date_range+extra, dtick)
         xticks = tick_vals - offset
     else:
-        xticks = ax.get_xticks()
+        xticks = np.asarray(ax.get_xticks())
         dtick = xticks[1]-xticks[0]
         shift = offset - dtick*(offset//dtick)
-        xticks -= shift
-        tick_vals = [x+offset-shift for x in xticks]
+        xticks = xticks - shift
+        tick_vals = xticks + offset - shift
 
     ax.set_xticks(xticks)
     if step>=1:
-        tick_labels = ["%d"%(int(x)) for x in tick_vals]
+        tick_labels = np.char.mod("%d", tick_vals.astype(int))
     else:
-        tick_labels = ["%1.2f"%(x) for x in tick_vals]
+        tick_labels = np.char.mod("%1.2f", tick_vals)
     ax.set_xlim((0,date_range))
     ax.set_xticklabels(tick_labels)
     ax.set_xlabel('year')
@@ -872,37 +1069,49 @@ def plot_vs_years(tt, step = None, ax=None, confidence=None, ticks=True, **kwarg
 
     # put shaded boxes to delineate years
     if step:
-        ylim = ax.get_ylim()
-        xlim = ax.get_xlim()
-        from matplotlib.patches import Rectangle
-        for yi,year in enumerate(np.arange(np.floor(tick_vals[0]), tick_vals[-1]+.01, step)):
-            pos = year - offset
-            r = Rectangle((pos, ylim[1]-5),
-                          step, ylim[0]-ylim[1]+10,
-                          facecolor=[0.7+0.1*(1+yi%2)] * 3,
-                          edgecolor=[1,1,1])
-            ax.add_patch(r)
-            if year in tick_vals and pos>=xlim[0] and pos<=xlim[1] and ticks:
+        y0, y1 = ax.get_ylim()
+        x0, x1 = ax.get_xlim()
+        box_bottom, box_height = y1-5, y0-y1+10
+        label_y = y0-0.04*(y1-y0)
+        # year values are generated like tick_vals so that they compare equal
+        years = np.arange(np.floor(tick_vals[0]), tick_vals[-1]+.01, step)
+        year_index = np.arange(len(years))
+        positions = years - offset
+        # draw all boxes as one collection with alternating shades
+        boxes = [Rectangle((pos, box_bottom), step, box_height)
+                 for pos in positions]
+        shades = 0.7+0.1*(1+(year_index&1))
+        ax.add_collection(PatchCollection(boxes, facecolors=np.repeat(shades[:,None], 3, axis=1),
+                                          edgecolors=[1,1,1]))
+        if ticks:
+            labeled = np.isin(years, tick_vals)&(positions>=x0)&(positions<=x1)
+            for year, pos in zip(years[labeled], positions[labeled]):
                 label_str = "%1.2f"%(step*(year//step)) if step<1 else  str(int(year))
-                ax.text(pos,ylim[0]-0.04*(ylim[1]-ylim[0]), label_str,
+                ax.text(pos, label_y, label_str,
                         horizontalalignment='center')
         ax.set_axis_off()
 
     # add confidence intervals to the tree graph -- grey bars
     if confidence:
-        tree_layout(tt.tree)
         if not hasattr(tt.tree.root, "marginal_inverse_cdf"):
             raise NotReadyError("marginal time tree reconstruction required for confidence intervals")
         elif type(confidence) is float:
-            cfunc = tt.get_max_posterior_region
+            cfunc = lambda nodes, fraction: np.array([tt.get_max_posterior_region(n, fraction) for n in nodes])
         elif len(confidence)==2:
-            cfunc = tt.get_confidence_interval
+            cfunc = tt.get_confidence_intervals
         else:
             raise NotReadyError("confidence needs to be either a float (for max posterior region) or a two numbers specifying lower and upper bounds")
 
-        for n in tt.tree.find_clades():
-            pos = cfunc(n, confidence)
-            ax.plot(pos-offset, np.ones(len(pos))*n.ypos, lw=3, c=(0.5,0.5,0.5))
+        _tree_layout(tt.tree)
+        nodes = list(tt.tree.find_clades())
+        ypos = np.fromiter((n.ypos for n in nodes), dtype=float, count=len(nodes))
+        segments = np.empty((len(nodes), 2, 2))
+        segments[:,:,0] = cfunc(nodes, confidence) - offset
+        segments[:,:,1] = ypos[:,None]
+        # draw all bars as one collection, styled like lines drawn with ax.plot
+        ax.add_collection(LineCollection(segments, linewidths=3, colors=[(0.5,0.5,0.5)],
+                                         capstyle='projecting'))
+        ax.autoscale_view()
     return fig, ax
 
 def treetime_to_newick(tt, outf):